@@ -1,77 +1,233 @@
-from fastapi import FastAPI, HTTPException, Query
-from fastapi.middleware.cors import CORSMiddleware
-from typing import Optional, List
+from fastapi import FastAPI, HTTPException, Query, Request
+from fastapi.responses import ORJSONResponse, Response
+from starlette.datastructures import Headers
+from typing import Any, Optional, List
 import gallifrey
-from datetime import datetime, timedelta
+from cachetools import TTLCache
+from cachetools.keys import hashkey
+import msgspec
+from datetime import date, datetime, timedelta
+from functools import wraps
+from operator import itemgetter
+from contextlib import contextmanager
 import re
+import queue
+import threading
+import inspect
+import hashlib
 
 app = FastAPI(
     title="Torre Automation API",
     description="API para automatizaciones de contacto con clientes por flags",
-    version="2.0.0"
+    version="2.0.0",
+    default_response_class=ORJSONResponse
 )
 
-# CORS
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
+# CORS abierto (cualquier origen, método y header) con headers precalculados
+_CORS_SIMPLE_HEADERS = [
+    (b"access-control-allow-origin", b"*"),
+    (b"access-control-allow-credentials", b"true")
+]
+_CORS_PREFLIGHT_HEADERS = {
+    "access-control-allow-methods": "DELETE, GET, HEAD, OPTIONS, PATCH, POST, PUT",
+    "access-control-allow-credentials": "true",
+    "access-control-max-age": "600",
+    "vary": "Origin"
+}
 
-# Conexión singleton
-_poseidon = None
+class SimpleCORSMiddleware:
+    """
+    Equivale a CORSMiddleware con allow_*=["*"] y allow_credentials=True,
+    pero sin revisar listas de orígenes/métodos en cada request
+    Los preflight (OPTIONS) se responden directamente sin llegar a la app
+    """
+    def __init__(self, app):
+        self.app = app
+    
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        
+        headers = Headers(scope=scope)
+        origin = headers.get("origin")
+        if origin is None:
+            await self.app(scope, receive, send)
+            return
+        
+        if scope["method"] == "OPTIONS" and "access-control-request-method" in headers:
+            preflight_headers = {"access-control-allow-origin": origin, **_CORS_PREFLIGHT_HEADERS}
+            requested_headers = headers.get("access-control-request-headers")
+            if requested_headers:
+                preflight_headers["access-control-allow-headers"] = requested_headers
+            response = Response(status_code=204, headers=preflight_headers)
+            await response(scope, receive, send)
+            return
+        
+        # Con cookies el navegador no acepta "*": se devuelve el origen explícito
+        if "cookie" in headers:
+            cors_headers = [
+                (b"access-control-allow-origin", origin.encode("latin-1")),
+                (b"access-control-allow-credentials", b"true"),
+                (b"vary", b"Origin")
+            ]
+        else:
+            cors_headers = _CORS_SIMPLE_HEADERS
+        
+        async def send_with_cors(message):
+            if message["type"] == "http.response.start":
+                message["headers"] = list(message.get("headers", [])) + cors_headers
+            await send(message)
+        
+        await self.app(scope, receive, send_with_cors)
 
-def get_poseidon():
-    """Conexión única a Poseidon"""
-    global _poseidon
-    if _poseidon is None:
-        _poseidon = gallifrey.database_factories.secret_manager_database_factory("poseidon")
-    return _poseidon
+app.add_middleware(SimpleCORSMiddleware)
 
-def build_job_link(hash_id: str) -> str:
-    """Construye el link de la vacante"""
-    return f"https://torre.ai/post/{hash_id}"
+# Pool de conexiones a Poseidon
+POOL_SIZE = 20
+_pool = queue.LifoQueue(maxsize=POOL_SIZE)
 
-def detect_industry(vacancy_name: str, company_name: str) -> str:
+@contextmanager
+def get_conn():
     """
-    Detecta la industria basándose en palabras clave
-    Esto se refinará más adelante según tus necesidades
+    Presta una conexión a Poseidon del pool y la devuelve al terminar
+    Si la query falla la conexión se descarta para no reciclar sockets rotos
     """
-    text = f"{vacancy_name} {company_name}".lower()
-    
-    # Tech
-    if any(word in text for word in ['developer', 'engineer', 'software', 'programmer', 'tech', 'data', 'cloud', 'devops', 'frontend', 'backend']):
-        return "technology"
-    
-    # Sales/Marketing
-    elif any(word in text for word in ['sales', 'marketing', 'account', 'business development', 'growth']):
-        return "sales_marketing"
-    
-    # Finance
-    elif any(word in text for word in ['finance', 'accountant', 'financial', 'controller', 'cfo']):
-        return "finance"
-    
-    # Healthcare
-    elif any(word in text for word in ['health', 'medical', 'doctor', 'nurse', 'clinical']):
-        return "healthcare"
-    
-    # Design
-    elif any(word in text for word in ['design', 'ux', 'ui', 'graphic', 'creative']):
-        return "design"
+    try:
+        conn = _pool.get_nowait()
+    except queue.Empty:
+        conn = gallifrey.database_factories.secret_manager_database_factory("poseidon")
     
-    # HR/Operations
-    elif any(word in text for word in ['human resources', 'hr', 'operations', 'admin']):
-        return "operations_hr"
+    try:
+        yield conn
+    except Exception:
+        conn = None
+        raise
+    finally:
+        if conn is not None:
+            try:
+                _pool.put_nowait(conn)
+            except queue.Full:
+                pass
+
+# Cache en memoria de respuestas de flags (n8n consulta lo mismo una y otra vez)
+CACHE_TTL_SECONDS = 90
+_cache = TTLCache(maxsize=64, ttl=CACHE_TTL_SECONDS)
+_cache_lock = threading.Lock()
+
+def ttl_cached(name: str):
+    """
+    Cachea la respuesta del endpoint por (name, parámetros) durante CACHE_TTL_SECONDS
+    Las respuestas con error no se cachean
+    """
+    def decorator(func):
+        signature = inspect.signature(func)
+        
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            bound = signature.bind(*args, **kwargs)
+            key = hashkey(name, *bound.arguments.items())
+            
+            with _cache_lock:
+                payload = _cache.get(key)
+            if payload is not None:
+                return payload
+            
+            payload = func(*args, **kwargs)
+            if payload.get("success"):
+                with _cache_lock:
+                    _cache[key] = payload
+            return payload
+        
+        return wrapper
+    return decorator
+
+# Los clientes pueden reutilizar la respuesta durante este tiempo (menor que el TTL del cache)
+HTTP_MAX_AGE_SECONDS = 60
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Indica si el header If-None-Match del cliente incluye el ETag actual"""
+    if not if_none_match:
+        return False
+    candidates = [value.strip() for value in if_none_match.split(",")]
+    return etag in candidates or "*" in candidates
+
+def msgspec_response(func):
+    """
+    Serializa la respuesta del endpoint con msgspec (necesario para las filas FlagRow)
+    y agrega ETag: si el cliente manda el mismo If-None-Match se responde 304 sin body
+    Agrega el parámetro request a la firma del endpoint
+    """
+    signature = inspect.signature(func)
     
-    # Customer Service
-    elif any(word in text for word in ['customer', 'support', 'service', 'success']):
-        return "customer_service"
+    @wraps(func)
+    def wrapper(*args, request: Request, **kwargs):
+        payload = func(*args, **kwargs)
+        body = msgspec.json.encode(payload)
+        etag = 'W/"' + hashlib.blake2b(body, digest_size=8).hexdigest() + '"'
+        
+        headers = {"etag": etag}
+        if payload.get("success"):
+            headers["cache-control"] = f"max-age={HTTP_MAX_AGE_SECONDS}"
+        
+        if etag_matches(request.headers.get("if-none-match"), etag):
+            return Response(status_code=304, headers=headers)
+        return Response(body, media_type="application/json", headers=headers)
     
-    # Default
-    else:
-        return "general"
+    wrapper.__signature__ = signature.replace(parameters=[
+        *signature.parameters.values(),
+        inspect.Parameter("request", inspect.Parameter.KEYWORD_ONLY, annotation=Request)
+    ])
+    return wrapper
+
+# Tabla de industrias: el orden define la prioridad cuando hay varias coincidencias
+INDUSTRIES = {
+    "technology": {
+        "name": "Technology",
+        "keywords": ["developer", "engineer", "software", "programmer", "tech", "data", "cloud", "devops", "frontend", "backend"]
+    },
+    "sales_marketing": {
+        "name": "Sales & Marketing",
+        "keywords": ["sales", "marketing", "account", "business development", "growth"]
+    },
+    "finance": {
+        "name": "Finance",
+        "keywords": ["finance", "accountant", "financial", "controller", "cfo"]
+    },
+    "healthcare": {
+        "name": "Healthcare",
+        "keywords": ["health", "medical", "doctor", "nurse", "clinical"]
+    },
+    "design": {
+        "name": "Design",
+        "keywords": ["design", "ux", "ui", "graphic", "creative"]
+    },
+    "operations_hr": {
+        "name": "Operations & HR",
+        "keywords": ["human resources", "hr", "operations", "admin"]
+    },
+    "customer_service": {
+        "name": "Customer Service",
+        "keywords": ["customer", "support", "service", "success"]
+    },
+    "general": {
+        "name": "General",
+        "keywords": []
+    }
+}
+
+# Clasificación de industria dentro del SELECT: el primer WHEN que coincide gana,
+# igual que el orden de INDUSTRIES. Las keywords deben empezar palabra (\m) para
+# que "hr" no coincida con "chronic" ni "ui" con "build", pero "designer" sí con "design"
+_INDUSTRY_TEXT_SQL = (
+    "(COALESCE(NULLIF(mj.objective, ''), 'Untitled Position') || ' ' || "
+    "COALESCE(NULLIF(mj.organization_name, ''), 'Company'))"
+)
+INDUSTRY_CASE_SQL = "CASE " + " ".join(
+    f"WHEN {_INDUSTRY_TEXT_SQL} ~* '\\m({'|'.join(info['keywords'])})' THEN '{industry}'"
+    for industry, info in INDUSTRIES.items()
+    if info["keywords"]
+) + " ELSE 'general' END"
 
 @app.get("/")
 def health_check():
@@ -79,7 +235,7 @@ def health_check():
     return {
         "status": "running",
         "service": "Torre Automation API",
-        "timestamp": datetime.now().isoformat(),
+        "timestamp": datetime.now(),
         "version": "2.0.0",
         "available_flags": [
             "new-ts-posting",
@@ -92,10 +248,103 @@ def health_check():
         ]
     }
 
+# Columnas comunes a todas las flags (mismo orden en todas las queries).
+# Los defaults y el link se resuelven en SQL; las fechas las serializa orjson
+FLAG_COLUMNS_SQL = f"""
+            mg.name AS ts_name,
+            mg.email AS ts_email,
+            COALESCE(NULLIF(mj.objective, ''), 'Untitled Position') AS vacancy_name,
+            'https://torre.ai/post/' || mj.hash_id AS vacancy_link,
+            mj.locale AS locale,
+            mj.published_date AS published_date,
+            COALESCE(NULLIF(mj.organization_name, ''), 'Company') AS company_name,
+            mj.poster_gg_id AS poster_gg_id,
+            {INDUSTRY_CASE_SQL} AS industry,
+            mj.review AS review_status,
+            mj.valuable_appls AS valuable_appls"""
+
+_COMMON_FIELDS = (
+    "ts_name", "ts_email", "vacancy_name", "vacancy_link", "locale",
+    "published_date", "company_name", "poster_gg_id"
+)
+FLAG_COLUMNS = _COMMON_FIELDS + ("industry", "review_status", "valuable_appls")
+
+# Filas de cada flag: structs en vez de dicts, msgspec las serializa sin pasar por dict.
+# El tag "flag" identifica la flag de cada fila en el JSON
+class FlagRow(msgspec.Struct, tag_field="flag"):
+    ts_name: Optional[str]
+    ts_email: Optional[str]
+    vacancy_name: str
+    vacancy_link: Optional[str]
+    locale: Optional[str]
+    published_date: Optional[date]
+    company_name: str
+    poster_gg_id: Any
+
+class NewTsPostingRow(FlagRow, tag="new_ts_posting"):
+    review_status: Optional[str]
+    industry: str
+
+class LessThan6Row(FlagRow, tag="less_than_6"):
+    valuable_appls: Optional[int]
+    industry: str
+
+class NoActivityRow(FlagRow, tag="no_activity"):
+    industry: str
+
+FLAG_ROWS = {
+    "new_ts_posting": NewTsPostingRow,
+    "less_than_6": LessThan6Row,
+    "no_activity": NoActivityRow
+}
+# Columnas de FLAG_COLUMNS_SQL en el orden de los campos de cada struct
+_FLAG_GETTERS = {
+    flag: itemgetter(*(FLAG_COLUMNS.index(field) for field in row_type.__struct_fields__))
+    for flag, row_type in FLAG_ROWS.items()
+}
+
+FLAG_DESCRIPTIONS = {
+    "new_ts_posting": "TSs posting for the first time (includes approved & unapproved)",
+    "less_than_6": "Approved openings with less than 6 relevant applicants",
+    "no_activity": "Approved jobs with no activity in pipeline for {inactive_days_threshold}+ days"
+}
+
+def build_flag_data(rows, flag: str) -> list:
+    """Convierte las filas de FLAG_COLUMNS_SQL en los structs de la flag"""
+    row_type = FLAG_ROWS[flag]
+    getter = _FLAG_GETTERS[flag]
+    return [row_type(*getter(r)) for r in rows]
+
+def build_flag_payload(flag: str, rows, **params) -> dict:
+    """Arma la respuesta estándar de una flag; params se incluyen tal cual en la respuesta"""
+    data = build_flag_data(rows, flag)
+    return {
+        "success": True,
+        "flag": flag,
+        "description": FLAG_DESCRIPTIONS[flag].format(**params),
+        "count": len(data),
+        **params,
+        "data": data
+    }
+
 # ============================================
 # FLAG 1: NEW TS POSTING (Prioridad ALTA)
 # ============================================
+NEW_TS_POSTING_SQL = f"""
+        SELECT DISTINCT{FLAG_COLUMNS_SQL}
+        FROM poseidon.mart_jobs mj
+        INNER JOIN poseidon.mart_genomes mg ON mj.poster_gg_id = mg.gg_id
+        WHERE mj.published_date = mj.poster_first_post
+            AND mj.status = 'open'
+            AND mj.published_date >= current_date - make_interval(days => %s)
+            AND mj.published_date < current_date + INTERVAL '1 day'
+            AND (mj.business_line <> 'torre_os' OR mj.business_line IS NULL)
+        ORDER BY published_date DESC;
+        """
+
 @app.get("/flags/new-ts-posting")
+@msgspec_response
+@ttl_cached("new_ts_posting")
 def get_new_ts_posting(days: int = Query(7, description="Días hacia atrás")):
     """
     Flag: New TS Posting
@@ -117,58 +366,10 @@ def get_new_ts_posting(days: int = Query(7, description="Días hacia atrás")):
     - Industria detectada (para personalización)
     """
     try:
-        poseidon = get_poseidon()
-        
-        query = f"""
-        SELECT DISTINCT
-            mg.name AS ts_name,
-            mg.email AS ts_email,
-            mj.objective AS vacancy_name,
-            mj.hash_id AS hash_id,
-            mj.locale AS locale,
-            mj.published_date AS published_date,
-            mj.organization_name AS company_name,
-            mj.poster_gg_id AS poster_gg_id,
-            mj.review AS review_status
-        FROM poseidon.mart_jobs mj
-        INNER JOIN poseidon.mart_genomes mg ON mj.poster_gg_id = mg.gg_id
-        WHERE mj.published_date = mj.poster_first_post
-            AND mj.status = 'open'
-            AND mj.published_date >= current_date - INTERVAL '{days} days'
-            AND mj.published_date < current_date + INTERVAL '1 day'
-            AND (mj.business_line <> 'torre_os' OR mj.business_line IS NULL)
-        ORDER BY mj.published_date DESC;
-        """
-        
-        results = poseidon.execute_query(query)
+        with get_conn() as poseidon:
+            results = poseidon.execute_query(NEW_TS_POSTING_SQL, (days,))
         
-        data = []
-        for r in results:
-            vacancy_name = r[2] if r[2] else "Untitled Position"
-            company_name = r[6] if r[6] else "Company"
-            
-            data.append({
-                "ts_name": r[0],
-                "ts_email": r[1],
-                "vacancy_name": vacancy_name,
-                "vacancy_link": build_job_link(r[3]),
-                "locale": r[4],
-                "published_date": str(r[5]),
-                "company_name": company_name,
-                "poster_gg_id": r[7],
-                "review_status": r[8],
-                "industry": detect_industry(vacancy_name, company_name),
-                "flag": "new_ts_posting"
-            })
-        
-        return {
-            "success": True,
-            "flag": "new_ts_posting",
-            "description": "TSs posting for the first time (includes approved & unapproved)",
-            "count": len(data),
-            "days_lookback": days,
-            "data": data
-        }
+        return build_flag_payload("new_ts_posting", results, days_lookback=days)
     
     except Exception as e:
         return {"success": False, "error": str(e)}
@@ -176,7 +377,22 @@ def get_new_ts_posting(days: int = Query(7, description="Días hacia atrás")):
 # ============================================
 # FLAG 2: LESS THAN 6
 # ============================================
+LESS_THAN_6_SQL = f"""
+        SELECT DISTINCT{FLAG_COLUMNS_SQL}
+        FROM poseidon.mart_jobs mj
+        INNER JOIN poseidon.mart_genomes mg ON mj.poster_gg_id = mg.gg_id
+        WHERE mj.review = 'approved'
+            AND mj.status = 'open'
+            AND mj.valuable_appls < 6
+            AND mj.published_date >= current_date - make_interval(days => %s)
+            AND mj.published_date < current_date + INTERVAL '1 day'
+            AND (mj.business_line <> 'torre_os' OR mj.business_line IS NULL)
+        ORDER BY published_date DESC;
+        """
+
 @app.get("/flags/less-than-6")
+@msgspec_response
+@ttl_cached("less_than_6")
 def get_less_than_6(days: int = Query(30, description="Días hacia atrás")):
     """
     Flag: Less than 6
@@ -187,59 +403,10 @@ def get_less_than_6(days: int = Query(30, description="Días hacia atrás")):
     Excluye: business_line = 'torre_os'
     """
     try:
-        poseidon = get_poseidon()
-        
-        query = f"""
-        SELECT DISTINCT
-            mg.name AS ts_name,
-            mg.email AS ts_email,
-            mj.objective AS vacancy_name,
-            mj.hash_id AS hash_id,
-            mj.locale AS locale,
-            mj.published_date AS published_date,
-            mj.organization_name AS company_name,
-            mj.poster_gg_id AS poster_gg_id,
-            mj.valuable_appls AS valuable_appls
-        FROM poseidon.mart_jobs mj
-        INNER JOIN poseidon.mart_genomes mg ON mj.poster_gg_id = mg.gg_id
-        WHERE mj.review = 'approved'
-            AND mj.status = 'open'
-            AND mj.valuable_appls < 6
-            AND mj.published_date >= current_date - INTERVAL '{days} days'
-            AND mj.published_date < current_date + INTERVAL '1 day'
-            AND (mj.business_line <> 'torre_os' OR mj.business_line IS NULL)
-        ORDER BY mj.published_date DESC;
-        """
+        with get_conn() as poseidon:
+            results = poseidon.execute_query(LESS_THAN_6_SQL, (days,))
         
-        results = poseidon.execute_query(query)
-        
-        data = []
-        for r in results:
-            vacancy_name = r[2] if r[2] else "Untitled Position"
-            company_name = r[6] if r[6] else "Company"
-            
-            data.append({
-                "ts_name": r[0],
-                "ts_email": r[1],
-                "vacancy_name": vacancy_name,
-                "vacancy_link": build_job_link(r[3]),
-                "locale": r[4],
-                "published_date": str(r[5]),
-                "company_name": company_name,
-                "poster_gg_id": r[7],
-                "valuable_appls": r[8],
-                "industry": detect_industry(vacancy_name, company_name),
-                "flag": "less_than_6"
-            })
-        
-        return {
-            "success": True,
-            "flag": "less_than_6",
-            "description": "Approved openings with less than 6 relevant applicants",
-            "count": len(data),
-            "days_lookback": days,
-            "data": data
-        }
+        return build_flag_payload("less_than_6", results, days_lookback=days)
     
     except Exception as e:
         return {"success": False, "error": str(e)}
@@ -247,7 +414,25 @@ def get_less_than_6(days: int = Query(30, description="Días hacia atrás")):
 # ============================================
 # FLAG 3: NO ACTIVITY (Prioridad ALTA)
 # ============================================
+NO_ACTIVITY_SQL = f"""
+        SELECT DISTINCT{FLAG_COLUMNS_SQL}
+        FROM poseidon.mart_jobs mj
+        INNER JOIN poseidon.mart_genomes mg ON mj.poster_gg_id = mg.gg_id
+        LEFT JOIN poseidon.mv_last_activity activity ON mj.opportunity_id = activity.opportunity_id
+        WHERE mj.review = 'approved'
+            AND mj.status = 'open'
+            AND mj.published_date >= current_date - make_interval(days => %s)
+            AND (mj.business_line <> 'torre_os' OR mj.business_line IS NULL)
+            AND (
+                activity.last_activity < current_date - make_interval(days => %s)
+                OR activity.last_activity IS NULL
+            )
+        ORDER BY published_date DESC;
+        """
+
 @app.get("/flags/no-activity")
+@msgspec_response
+@ttl_cached("no_activity")
 def get_no_activity(
     inactive_days: int = Query(7, description="Días sin actividad"),
     lookback_days: int = Query(30, description="Días hacia atrás para publicación")
@@ -260,73 +445,18 @@ def get_no_activity(
     Solo: status = 'open'
     Excluye: business_line = 'torre_os'
     
-    Nota: Esta query puede tardar más
+    Nota: la última actividad sale de mv_last_activity (se refresca cada hora)
     """
     try:
-        poseidon = get_poseidon()
+        with get_conn() as poseidon:
+            results = poseidon.execute_query(NO_ACTIVITY_SQL, (lookback_days, inactive_days))
         
-        query = f"""
-        SELECT DISTINCT
-            mg.name AS ts_name,
-            mg.email AS ts_email,
-            mj.objective AS vacancy_name,
-            mj.hash_id AS hash_id,
-            mj.locale AS locale,
-            mj.published_date AS published_date,
-            mj.organization_name AS company_name,
-            mj.poster_gg_id AS poster_gg_id
-        FROM poseidon.mart_jobs mj
-        INNER JOIN poseidon.mart_genomes mg ON mj.poster_gg_id = mg.gg_id
-        LEFT JOIN (
-            SELECT 
-                ma.opportunity_id,
-                MAX(GREATEST(
-                    COALESCE(ma.disqualified_date, '1970-01-01'::timestamp),
-                    COALESCE(ma.mm_date, '1970-01-01'::timestamp)
-                )) AS last_activity
-            FROM poseidon.mart_applications ma
-            GROUP BY ma.opportunity_id
-        ) AS activity ON mj.opportunity_id = activity.opportunity_id
-        WHERE mj.review = 'approved'
-            AND mj.status = 'open'
-            AND mj.published_date >= current_date - INTERVAL '{lookback_days} days'
-            AND (mj.business_line <> 'torre_os' OR mj.business_line IS NULL)
-            AND (
-                activity.last_activity < current_date - INTERVAL '{inactive_days} days'
-                OR activity.last_activity IS NULL
-            )
-        ORDER BY mj.published_date DESC;
-        """
-        
-        results = poseidon.execute_query(query)
-        
-        data = []
-        for r in results:
-            vacancy_name = r[2] if r[2] else "Untitled Position"
-            company_name = r[6] if r[6] else "Company"
-            
-            data.append({
-                "ts_name": r[0],
-                "ts_email": r[1],
-                "vacancy_name": vacancy_name,
-                "vacancy_link": build_job_link(r[3]),
-                "locale": r[4],
-                "published_date": str(r[5]),
-                "company_name": company_name,
-                "poster_gg_id": r[7],
-                "industry": detect_industry(vacancy_name, company_name),
-                "flag": "no_activity"
-            })
-        
-        return {
-            "success": True,
-            "flag": "no_activity",
-            "description": f"Approved jobs with no activity in pipeline for {inactive_days}+ days",
-            "count": len(data),
-            "inactive_days_threshold": inactive_days,
-            "lookback_days": lookback_days,
-            "data": data
-        }
+        return build_flag_payload(
+            "no_activity",
+            results,
+            inactive_days_threshold=inactive_days,
+            lookback_days=lookback_days
+        )
     
     except Exception as e:
         return {"success": False, "error": str(e)}
@@ -334,7 +464,47 @@ def get_no_activity(
 # ============================================
 # ENDPOINT MULTI-FLAG (Para queries complejas)
 # ============================================
+ALL_PRIORITIES_INACTIVE_DAYS = 7
+
+# Las tres flags en un solo round-trip: el CTE filtra mart_jobs una vez y
+# cada rama del UNION ALL aplica su condición; la última columna es la flag
+_BASE_COLUMNS = ", ".join(FLAG_COLUMNS)
+ALL_PRIORITIES_SQL = f"""
+        WITH base AS (
+            SELECT DISTINCT{FLAG_COLUMNS_SQL},
+            mj.opportunity_id AS opportunity_id,
+            mj.poster_first_post AS poster_first_post
+            FROM poseidon.mart_jobs mj
+            INNER JOIN poseidon.mart_genomes mg ON mj.poster_gg_id = mg.gg_id
+            WHERE mj.status = 'open'
+                AND mj.published_date >= current_date - make_interval(days => %s)
+                AND (mj.business_line <> 'torre_os' OR mj.business_line IS NULL)
+        )
+        SELECT {_BASE_COLUMNS}, 'new_ts_posting' AS flag
+        FROM base
+        WHERE published_date = poster_first_post
+            AND published_date < current_date + INTERVAL '1 day'
+        UNION ALL
+        SELECT {_BASE_COLUMNS}, 'less_than_6' AS flag
+        FROM base
+        WHERE review_status = 'approved'
+            AND valuable_appls < 6
+            AND published_date < current_date + INTERVAL '1 day'
+        UNION ALL
+        SELECT {_BASE_COLUMNS}, 'no_activity' AS flag
+        FROM base
+        LEFT JOIN poseidon.mv_last_activity activity ON base.opportunity_id = activity.opportunity_id
+        WHERE review_status = 'approved'
+            AND (
+                activity.last_activity < current_date - make_interval(days => %s)
+                OR activity.last_activity IS NULL
+            )
+        ORDER BY published_date DESC;
+        """
+
 @app.get("/flags/all-priorities")
+@msgspec_response
+@ttl_cached("all_priorities")
 def get_all_high_priority_flags(days: int = Query(7, description="Días hacia atrás")):
     """
     Obtiene TODAS las flags de prioridad ALTA en una sola llamada
@@ -347,36 +517,41 @@ def get_all_high_priority_flags(days: int = Query(7, description="Días hacia at
     Útil para dashboard o vista consolidada
     """
     try:
-        results = {
-            "success": True,
-            "flags": {}
-        }
+        with get_conn() as poseidon:
+            rows = poseidon.execute_query(ALL_PRIORITIES_SQL, (days, ALL_PRIORITIES_INACTIVE_DAYS))
         
-        # Flag 1: New TS Posting
-        new_ts = get_new_ts_posting(days)
-        results["flags"]["new_ts_posting"] = new_ts
+        # Separar las filas por flag (la última columna)
+        buckets = {"new_ts_posting": [], "less_than_6": [], "no_activity": []}
+        for r in rows:
+            buckets[r[-1]].append(r)
         
-        # Flag 2: Less than 6
-        less_6 = get_less_than_6(days)
-        results["flags"]["less_than_6"] = less_6
+        new_ts = build_flag_payload("new_ts_posting", buckets["new_ts_posting"], days_lookback=days)
+        less_6 = build_flag_payload("less_than_6", buckets["less_than_6"], days_lookback=days)
+        no_activity = build_flag_payload(
+            "no_activity",
+            buckets["no_activity"],
+            inactive_days_threshold=ALL_PRIORITIES_INACTIVE_DAYS,
+            lookback_days=days
+        )
         
-        # Flag 3: No Activity
-        no_activity = get_no_activity(inactive_days=7, lookback_days=days)
-        results["flags"]["no_activity"] = no_activity
+        results = {
+            "success": True,
+            "flags": {
+                "new_ts_posting": new_ts,
+                "less_than_6": less_6,
+                "no_activity": no_activity
+            }
+        }
         
         # Resumen
-        total_count = (
-            new_ts.get("count", 0) + 
-            less_6.get("count", 0) + 
-            no_activity.get("count", 0)
-        )
+        total_count = new_ts["count"] + less_6["count"] + no_activity["count"]
         
         results["summary"] = {
             "total_clients_to_contact": total_count,
             "breakdown": {
-                "new_ts_posting": new_ts.get("count", 0),
-                "less_than_6": less_6.get("count", 0),
-                "no_activity": no_activity.get("count", 0)
+                "new_ts_posting": new_ts["count"],
+                "less_than_6": less_6["count"],
+                "no_activity": no_activity["count"]
             }
         }
         
@@ -385,6 +560,24 @@ def get_all_high_priority_flags(days: int = Query(7, description="Días hacia at
     except Exception as e:
         return {"success": False, "error": str(e)}
 
+# ============================================
+# ENDPOINT PARA INVALIDAR EL CACHE
+# ============================================
+@app.delete("/cache")
+def clear_cache():
+    """
+    Vacía el cache de respuestas de flags
+    Útil cuando se necesita ver datos frescos antes de que expire el TTL
+    """
+    with _cache_lock:
+        cleared = len(_cache)
+        _cache.clear()
+    
+    return {
+        "success": True,
+        "cleared": cleared
+    }
+
 # ============================================
 # ENDPOINT PARA DETALLES DE UN CLIENTE
 # ============================================
@@ -395,9 +588,7 @@ def get_client_details(email: str):
     Útil para personalización adicional
     """
     try:
-        poseidon = get_poseidon()
-        
-        query = f"""
+        query = """
         SELECT 
             mg.name,
             mg.email,
@@ -408,11 +599,12 @@ def get_client_details(email: str):
             MAX(mj.published_date) AS last_job_date
         FROM poseidon.mart_genomes mg
         LEFT JOIN poseidon.mart_jobs mj ON mg.gg_id = mj.poster_gg_id
-        WHERE mg.email = '{email}'
+        WHERE mg.email = %s
         GROUP BY mg.name, mg.email, mg.gg_id;
         """
         
-        results = poseidon.execute_query(query)
+        with get_conn() as poseidon:
+            results = poseidon.execute_query(query, (email,))
         
         if len(results) == 0:
             raise HTTPException(status_code=404, detail="Cliente no encontrado")
@@ -426,8 +618,8 @@ def get_client_details(email: str):
                 "gg_id": r[2],
                 "total_jobs_posted": r[3],
                 "open_jobs": r[4],
-                "first_job_date": str(r[5]) if r[5] else None,
-                "last_job_date": str(r[6]) if r[6] else None
+                "first_job_date": r[5],
+                "last_job_date": r[6]
             }
         }
     
@@ -447,40 +639,7 @@ def get_available_industries():
     """
     return {
         "success": True,
-        "industries": {
-            "technology": {
-                "name": "Technology",
-                "keywords": ["developer", "engineer", "software", "tech", "data", "cloud"]
-            },
-            "sales_marketing": {
-                "name": "Sales & Marketing",
-                "keywords": ["sales", "marketing", "account", "growth"]
-            },
-            "finance": {
-                "name": "Finance",
-                "keywords": ["finance", "accountant", "financial", "cfo"]
-            },
-            "healthcare": {
-                "name": "Healthcare",
-                "keywords": ["health", "medical", "doctor", "nurse"]
-            },
-            "design": {
-                "name": "Design",
-                "keywords": ["design", "ux", "ui", "graphic", "creative"]
-            },
-            "operations_hr": {
-                "name": "Operations & HR",
-                "keywords": ["hr", "operations", "admin"]
-            },
-            "customer_service": {
-                "name": "Customer Service",
-                "keywords": ["customer", "support", "service"]
-            },
-            "general": {
-                "name": "General",
-                "keywords": []
-            }
-        }
+        "industries": INDUSTRIES
     }
 
 if __name__ == "__main__":
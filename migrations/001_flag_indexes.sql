@@ -0,0 +1,22 @@
+-- Índices para las queries de flags
+--
+-- Todas las flags filtran mart_jobs por status = 'open', ventana de published_date
+-- y business_line distinto de 'torre_os'. El índice parcial usa exactamente ese
+-- predicado para que el planner lo pueda aplicar.
+--
+-- CREATE INDEX CONCURRENTLY no puede correr dentro de una transacción:
+-- ejecutar este archivo con psql sin --single-transaction.
+--
+-- Verificar antes/después con:
+--   EXPLAIN (ANALYZE, BUFFERS) <query de la flag>
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS mart_jobs_open_flags_idx
+    ON poseidon.mart_jobs (published_date DESC, review)
+    INCLUDE (poster_first_post, valuable_appls, poster_gg_id, opportunity_id)
+    WHERE status = 'open'
+        AND (business_line <> 'torre_os' OR business_line IS NULL);
+
+-- Agregado de última actividad de no-activity: permite index-only scan por oportunidad
+CREATE INDEX CONCURRENTLY IF NOT EXISTS mart_applications_activity_idx
+    ON poseidon.mart_applications (opportunity_id)
+    INCLUDE (disqualified_date, mm_date);
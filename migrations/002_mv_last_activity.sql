@@ -0,0 +1,24 @@
+-- Última actividad del pipeline por oportunidad, precalculada para no-activity
+--
+-- La flag mide inactividad en días, así que refrescar cada hora es suficiente.
+-- El índice único permite REFRESH ... CONCURRENTLY sin bloquear lecturas.
+
+CREATE MATERIALIZED VIEW IF NOT EXISTS poseidon.mv_last_activity AS
+SELECT
+    ma.opportunity_id,
+    MAX(GREATEST(
+        COALESCE(ma.disqualified_date, '1970-01-01'::timestamp),
+        COALESCE(ma.mm_date, '1970-01-01'::timestamp)
+    )) AS last_activity
+FROM poseidon.mart_applications ma
+GROUP BY ma.opportunity_id;
+
+CREATE UNIQUE INDEX IF NOT EXISTS mv_last_activity_opportunity_id_idx
+    ON poseidon.mv_last_activity (opportunity_id);
+
+-- Refresco horario (requiere la extensión pg_cron)
+SELECT cron.schedule(
+    'refresh-activity',
+    '0 * * * *',
+    'REFRESH MATERIALIZED VIEW CONCURRENTLY poseidon.mv_last_activity'
+);